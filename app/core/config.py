@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 # Updated for local RAG with lower similarity threshold (0.1 works for sentence-transformers)
 
 
@@ -9,27 +10,51 @@ class Settings(BaseSettings):
     # Local Embedding Configuration
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
     embedding_dimension: int = 384  # 384 for all-MiniLM-L6-v2
+    embedding_backend: str = "onnx"  # "onnx" (INT8 onnxruntime) or "torch" (sentence-transformers)
+    embedding_max_seq_length: int = 256  # all-MiniLM-L6-v2 was trained with 256-token inputs
+    embedding_batch_size: int = 64  # texts per encode call, after sorting by token length
+    embedding_quantize: bool = True  # dynamic INT8 Linear layers for the torch backend on CPU
+    embedding_micro_batch_size: int = 32  # concurrent query embeddings coalesced per encode
+    embedding_micro_batch_wait_ms: float = 5  # how long a micro-batch waits to fill up
+    onnx_model_dir: str = "./models/onnx"
     
     # Local LLM Configuration (Ollama)
     ollama_base_url: str = "http://localhost:11434"
     ollama_model: str = "llama3"
     llm_temperature: float = 0.0
+    ollama_keep_alive: str = "30m"  # keep the model loaded between queries
+    ollama_num_ctx: int = 4096
+    ollama_num_thread: Optional[int] = None  # None lets Ollama pick (physical cores)
     
     # Qdrant Configuration
     qdrant_host: str = "localhost"
     qdrant_port: int = 6333
+    qdrant_grpc_port: int = 6334
+    qdrant_prefer_grpc: bool = True
+    qdrant_pool_size: int = 100  # REST connection pool; unused when gRPC is preferred
+    qdrant_upsert_batch_size: int = 64  # points per upsert request
+    qdrant_upsert_concurrency: int = 4  # upsert requests in flight at once
+    hnsw_m: int = 16  # graph degree; applies when the collection is created
+    hnsw_ef_construct: int = 100  # build-time beam width; applies when the collection is created
+    hnsw_ef: int = 64  # search-time beam width; higher trades latency for recall
+    exact_search_threshold: int = 1000  # documents with fewer chunks skip HNSW for exact search
     qdrant_collection_name: str = "research_papers"
     
     # Application Configuration
     max_pdf_size_mb: int = 20
     max_query_latency_seconds: int = 60  # Increased for local LLM (Ollama)
-    chunk_size: int = 500
-    chunk_overlap: int = 100
+    chunk_size: int = 256  # embedding-model tokens; capped at the model's input limit
+    chunk_overlap: int = 50
+    ingest_batch_size: int = 256  # chunks embedded and stored per upload batch
     top_k_retrieval: int = 5
     similarity_threshold: float = 0.75
     
     # Cache Configuration
     cache_dir: str = "./cache"
+    query_cache_enabled: bool = True
+    query_cache_max_entries: int = 1024
+    query_cache_similarity_threshold: float = 0.97
+    query_cache_ttl_seconds: int = 300
     
     class Config:
         env_file = ".env"
@@ -1,8 +1,11 @@
 import os
-import shutil
+import json
 from pathlib import Path
+from typing import AsyncIterator, Dict
+import aiofiles
 from fastapi import FastAPI, File, UploadFile, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from contextlib import asynccontextmanager
 import asyncio
 
@@ -10,6 +13,9 @@ from app.models.schemas import UploadResponse, QueryRequest, QueryResponse
 from app.services.rag_service import RAGService
 from app.core.config import get_settings
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+PDF_CONTENT_TYPES = {"application/pdf", "application/x-pdf", "application/octet-stream"}
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -17,9 +23,12 @@ async def lifespan(app: FastAPI):
     settings = get_settings()
     os.makedirs(settings.cache_dir, exist_ok=True)
     os.makedirs("uploads", exist_ok=True)
+    await rag_service.startup()
     
     yield
     
+    await rag_service.aclose()
+
 
 app = FastAPI(
     title="RAG Research Paper AI Assistant",
@@ -47,7 +56,8 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "upload": "/upload",
-            "query": "/query"
+            "query": "/query",
+            "query_stream": "/query/stream"
         }
     }
 
@@ -66,20 +76,32 @@ async def upload_document(file: UploadFile = File(...)):
     Raises:
         HTTPException: If file is invalid or processing fails
     """
-    if not file.filename.endswith('.pdf'):
+    if not file.filename.endswith('.pdf') or (
+        file.content_type and file.content_type not in PDF_CONTENT_TYPES
+    ):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Only PDF files are supported"
         )
     
+    settings = get_settings()
+    max_bytes = settings.max_pdf_size_mb * 1024 * 1024
+    
     temp_path = None
     try:
         temp_path = Path("uploads") / f"temp_{file.filename}"
         
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Stream to disk in chunks without blocking the event loop
+        written = 0
+        async with aiofiles.open(temp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(
+                        f"File size exceeds maximum allowed size ({settings.max_pdf_size_mb}MB)"
+                    )
+                await buffer.write(chunk)
         
-        settings = get_settings()
         timeout = settings.max_query_latency_seconds
         
         try:
@@ -153,6 +175,64 @@ async def query_document(request: QueryRequest):
         )
 
 
+@app.post("/query/stream")
+async def query_document_stream(request: QueryRequest):
+    """
+    Query a document and stream the answer as Server-Sent Events.
+    
+    Each `data:` frame is a JSON object: `{"token": ...}` while the answer is
+    generated, then `{"citations": [...], "done": true}`. A failure after the
+    stream has started is reported as a final `{"error": ...}` frame.
+    
+    Args:
+        request: QueryRequest with document_id, question, and optional top_k
+        
+    Returns:
+        StreamingResponse with media type text/event-stream
+        
+    Raises:
+        HTTPException: If document not found or retrieval fails
+    """
+    try:
+        settings = get_settings()
+        timeout = settings.max_query_latency_seconds
+        
+        try:
+            events = await asyncio.wait_for(
+                rag_service.stream_query(request),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                detail=f"Query processing exceeded {timeout} seconds"
+            )
+            
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to process query: {str(e)}"
+        )
+    
+    return StreamingResponse(_sse_frames(events), media_type="text/event-stream")
+
+
+async def _sse_frames(events: AsyncIterator[Dict]) -> AsyncIterator[str]:
+    """Encode answer events as Server-Sent Events frames."""
+    try:
+        async for event in events:
+            yield f"data: {json.dumps(event)}\n\n"
+    except Exception as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
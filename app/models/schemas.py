@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+import numpy as np
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, NamedTuple, Optional
 
 
 class UploadResponse(BaseModel):
@@ -38,6 +39,19 @@ class ChunkMetadata(BaseModel):
 
 class DocumentChunk(BaseModel):
     """Represents a chunk of text from a document."""
+    # The embedding is a float16 ndarray; pydantic stores it as-is instead of
+    # validating hundreds of floats per chunk
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    
     text: str
     metadata: ChunkMetadata
-    embedding: Optional[List[float]] = None
+    embedding: Optional[np.ndarray] = None
+
+
+class SearchHit(NamedTuple):
+    """A retrieved chunk and its similarity score."""
+    text: str
+    section: str
+    page: int
+    chunk_index: int
+    score: float
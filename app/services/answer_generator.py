@@ -1,7 +1,11 @@
-from typing import List, Dict
+import json
+from typing import List, Dict, AsyncIterator
 import httpx
+import numpy as np
 from app.core.config import get_settings
-from app.models.schemas import Citation, QueryResponse
+from app.models.schemas import Citation, QueryResponse, SearchHit
+
+INSUFFICIENT_INFORMATION_ANSWER = "Insufficient information in the document."
 
 
 class AnswerGenerator:
@@ -13,12 +17,30 @@ class AnswerGenerator:
         self.model = settings.ollama_model
         self.temperature = settings.llm_temperature
         self.similarity_threshold = settings.similarity_threshold
+        self.keep_alive = settings.ollama_keep_alive
+        self.options = {
+            "temperature": self.temperature,
+            "num_ctx": settings.ollama_num_ctx
+        }
+        if settings.ollama_num_thread:
+            self.options["num_thread"] = settings.ollama_num_thread
+        
+        # One pooled client for the app's lifetime: no connection setup per query
+        self.client = httpx.AsyncClient(
+            base_url=self.ollama_base_url,
+            timeout=60.0,
+            limits=httpx.Limits(max_keepalive_connections=8)
+        )
         print(f"Using Ollama LLM: {self.model} at {self.ollama_base_url}")
     
+    async def aclose(self):
+        """Close the pooled HTTP client."""
+        await self.client.aclose()
+    
     async def generate_answer(
         self, 
         question: str, 
-        retrieved_chunks: List[Dict]
+        retrieved_chunks: List[SearchHit]
     ) -> QueryResponse:
         """
         Generate an answer with citations from retrieved context.
@@ -33,49 +55,27 @@ class AnswerGenerator:
         # Debug logging
         print(f"Retrieved {len(retrieved_chunks)} chunks")
         if retrieved_chunks:
-            print(f"Similarity scores: {[chunk['score'] for chunk in retrieved_chunks[:3]]}")
+            print(f"Similarity scores: {[chunk.score for chunk in retrieved_chunks[:3]]}")
             print(f"Threshold: {self.similarity_threshold}")
         
-        if not retrieved_chunks or all(
-            chunk["score"] < self.similarity_threshold for chunk in retrieved_chunks
-        ):
+        relevant_chunks = self._select_relevant_chunks(retrieved_chunks)
+        
+        if not relevant_chunks:
             return QueryResponse(
-                answer="Insufficient information in the document.",
+                answer=INSUFFICIENT_INFORMATION_ANSWER,
                 citations=[]
             )
         
-        relevant_chunks = [
-            chunk for chunk in retrieved_chunks 
-            if chunk["score"] >= self.similarity_threshold
-        ]
-        
         print(f"Relevant chunks after threshold: {len(relevant_chunks)}")
         
-        context = self._format_context(relevant_chunks)
-        
-        system_prompt = self._get_system_prompt()
-        user_prompt = self._get_user_prompt(question, context)
-        
         try:
-            # Call Ollama API
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.ollama_base_url}/api/chat",
-                    json={
-                        "model": self.model,
-                        "messages": [
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        "stream": False,
-                        "options": {
-                            "temperature": self.temperature
-                        }
-                    }
-                )
-                response.raise_for_status()
-                result = response.json()
-                answer_text = result["message"]["content"].strip()
+            response = await self.client.post(
+                "/api/chat",
+                json=self._build_chat_request(question, relevant_chunks, stream=False)
+            )
+            response.raise_for_status()
+            result = response.json()
+            answer_text = result["message"]["content"].strip()
             
             citations = self._extract_citations(relevant_chunks)
             
@@ -85,14 +85,120 @@ class AnswerGenerator:
             )
             
         except httpx.ConnectError:
-            raise RuntimeError(
-                f"Failed to connect to Ollama at {self.ollama_base_url}. "
-                f"Please ensure Ollama is running: 'ollama serve' and model '{self.model}' is installed: 'ollama pull {self.model}'"
-            )
+            raise RuntimeError(self._connect_error_message())
+        except Exception as e:
+            raise RuntimeError(f"Failed to generate answer: {str(e)}")
+    
+    async def stream_answer(
+        self, 
+        question: str, 
+        retrieved_chunks: List[SearchHit]
+    ) -> AsyncIterator[Dict]:
+        """
+        Stream an answer token by token, followed by its citations.
+        
+        Args:
+            question: User's question
+            retrieved_chunks: List of retrieved chunk data with text, section, page, and score
+            
+        Yields:
+            {"token": str} events as the LLM produces them, then a final
+            {"citations": [...], "done": True} event
+        """
+        relevant_chunks = self._select_relevant_chunks(retrieved_chunks)
+        
+        if not relevant_chunks:
+            yield {"token": INSUFFICIENT_INFORMATION_ANSWER}
+            yield {"citations": [], "done": True}
+            return
+        
+        try:
+            async with self.client.stream(
+                "POST",
+                "/api/chat",
+                json=self._build_chat_request(question, relevant_chunks, stream=True)
+            ) as response:
+                response.raise_for_status()
+                
+                # Ollama streams one JSON object per line
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    
+                    event = json.loads(line)
+                    if "error" in event:
+                        raise RuntimeError(event["error"])
+                    
+                    content = event.get("message", {}).get("content")
+                    if content:
+                        yield {"token": content}
+                    
+                    if event.get("done"):
+                        break
+                        
+        except httpx.ConnectError:
+            raise RuntimeError(self._connect_error_message())
         except Exception as e:
             raise RuntimeError(f"Failed to generate answer: {str(e)}")
+        
+        citations = self._extract_citations(relevant_chunks)
+        yield {"citations": [citation.model_dump() for citation in citations], "done": True}
+    
+    def _select_relevant_chunks(self, retrieved_chunks: List[SearchHit]) -> List[SearchHit]:
+        """
+        Keep only chunks whose score clears the similarity threshold.
+        
+        Args:
+            retrieved_chunks: List of retrieved chunks with scores
+            
+        Returns:
+            Relevant chunks, in retrieval order
+        """
+        # float64 like the threshold, so scores at the boundary compare exactly
+        scores = np.fromiter(
+            (chunk.score for chunk in retrieved_chunks),
+            dtype=np.float64,
+            count=len(retrieved_chunks)
+        )
+        relevant_mask = scores >= self.similarity_threshold
+        
+        return [retrieved_chunks[idx] for idx in np.flatnonzero(relevant_mask)]
+    
+    def _build_chat_request(self, question: str, relevant_chunks: List[SearchHit], stream: bool) -> Dict:
+        """
+        Build the Ollama /api/chat request body.
+        
+        Args:
+            question: User's question
+            relevant_chunks: Chunks to use as context
+            stream: Whether Ollama should stream the response
+            
+        Returns:
+            JSON request body
+        """
+        context = self._format_context(relevant_chunks)
+        
+        # The system prompt is constant and sent first, so Ollama can reuse its
+        # cached prompt prefix across queries; keep_alive keeps the model loaded.
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self._get_system_prompt()},
+                {"role": "user", "content": self._get_user_prompt(question, context)}
+            ],
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": self.options
+        }
+    
+    def _connect_error_message(self) -> str:
+        """Get the error message for an unreachable Ollama server."""
+        return (
+            f"Failed to connect to Ollama at {self.ollama_base_url}. "
+            f"Please ensure Ollama is running: 'ollama serve' and model '{self.model}' is installed: 'ollama pull {self.model}'"
+        )
     
-    def _format_context(self, chunks: List[Dict]) -> str:
+    def _format_context(self, chunks: List[SearchHit]) -> str:
         """
         Format retrieved chunks into context for the LLM.
         
@@ -104,9 +210,9 @@ class AnswerGenerator:
         """
         context_parts = []
         for idx, chunk in enumerate(chunks, 1):
-            section = chunk["section"]
-            page = chunk["page"]
-            text = chunk["text"]
+            section = chunk.section
+            page = chunk.page
+            text = chunk.text
             
             context_parts.append(
                 f"[Source {idx}] (Section: {section}, Page: {page})\n{text}\n"
@@ -146,7 +252,7 @@ Question: {question}
 
 Please provide a detailed answer based on the context above. Include inline citations [Source N] for all claims."""
     
-    def _extract_citations(self, chunks: List[Dict]) -> List[Citation]:
+    def _extract_citations(self, chunks: List[SearchHit]) -> List[Citation]:
         """
         Extract citation information from retrieved chunks.
         
@@ -160,14 +266,14 @@ Please provide a detailed answer based on the context above. Include inline cita
         seen_citations = set()
         
         for chunk in chunks:
-            citation_key = (chunk["section"], chunk["page"])
+            citation_key = (chunk.section, chunk.page)
             
             if citation_key not in seen_citations:
-                text_snippet = chunk["text"][:200] + "..." if len(chunk["text"]) > 200 else chunk["text"]
+                text_snippet = chunk.text[:200] + "..." if len(chunk.text) > 200 else chunk.text
                 
                 citation = Citation(
-                    section=chunk["section"],
-                    page=chunk["page"],
+                    section=chunk.section,
+                    page=chunk.page,
                     text_snippet=text_snippet
                 )
                 citations.append(citation)
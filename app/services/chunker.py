@@ -1,44 +1,54 @@
-import tiktoken
-import random
-from typing import List, Dict
+import hashlib
+from typing import List, Dict, Iterator
+from transformers import PreTrainedTokenizerFast
 from app.models.schemas import DocumentChunk, ChunkMetadata
 
+# Chunk IDs are (40-bit document hash << 20) | position: unique, reproducible
+# and always below 2**60, inside Qdrant's unsigned 64-bit point ID range.
+CHUNK_INDEX_BITS = 20
+DOCUMENT_HASH_BYTES = 5
+
 
 class TextChunker:
     """Handles text chunking with token-based splitting and overlap."""
     
-    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 100):
+    def __init__(
+        self, 
+        tokenizer: PreTrainedTokenizerFast, 
+        chunk_size: int = 256, 
+        chunk_overlap: int = 50
+    ):
         """
         Initialize the chunker.
         
         Args:
+            tokenizer: The embedding model's (fast) tokenizer, so chunk sizes are
+                measured in the same tokens the model will see
             chunk_size: Maximum number of tokens per chunk
             chunk_overlap: Number of overlapping tokens between chunks
         """
+        self.tokenizer = tokenizer
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.encoding = tiktoken.get_encoding("cl100k_base")
     
     def chunk_pages(
         self, 
         pages_data: List[Dict[str, any]], 
         document_id: str
-    ) -> List[DocumentChunk]:
+    ) -> Iterator[DocumentChunk]:
         """
-        Chunk pages into smaller segments with metadata preservation.
+        Lazily chunk pages into smaller segments with metadata preservation.
         
         Args:
             pages_data: List of page data with text, page number, and section
             document_id: Unique identifier for the document
             
-        Returns:
-            List of DocumentChunk objects with metadata
+        Yields:
+            DocumentChunk objects with metadata, in document order
         """
-        chunks = []
-        
-        # Generate a unique base ID for this document's chunks to avoid collisions
-        # Use a random offset to ensure global uniqueness across documents
-        base_chunk_id = random.randint(1, 1_000_000_000)
+        # Derive this document's ID range from its ID so re-ingesting is idempotent
+        document_hash = hashlib.blake2b(document_id.encode(), digest_size=DOCUMENT_HASH_BYTES).digest()
+        base_chunk_id = int.from_bytes(document_hash, "big") << CHUNK_INDEX_BITS
         chunk_index = 0
         
         for page_data in pages_data:
@@ -49,25 +59,27 @@ class TextChunker:
             page_chunks = self._chunk_text(text)
             
             for chunk_text in page_chunks:
+                if chunk_index >= 1 << CHUNK_INDEX_BITS:
+                    raise ValueError(f"Document exceeds {1 << CHUNK_INDEX_BITS} chunks")
+                
                 # Create globally unique chunk ID
-                unique_chunk_id = base_chunk_id + chunk_index
+                unique_chunk_id = base_chunk_id | chunk_index
                 
-                metadata = ChunkMetadata(
+                # Fields are already well-typed here, so skip pydantic validation
+                metadata = ChunkMetadata.model_construct(
                     document_id=document_id,
                     section=section,
                     page=page_num,
                     chunk_index=unique_chunk_id
                 )
                 
-                chunk = DocumentChunk(
+                yield DocumentChunk.model_construct(
                     text=chunk_text,
-                    metadata=metadata
+                    metadata=metadata,
+                    embedding=None
                 )
                 
-                chunks.append(chunk)
                 chunk_index += 1
-        
-        return chunks
     
     def _chunk_text(self, text: str) -> List[str]:
         """
@@ -79,23 +91,25 @@ class TextChunker:
         Returns:
             List of text chunks
         """
-        tokens = self.encoding.encode(text)
-        chunks = []
+        # Character offsets of every token let chunks be sliced straight out of
+        # the original text, with no decode step
+        offsets = self.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False
+        )["offset_mapping"]
         
-        start = 0
-        while start < len(tokens):
-            end = start + self.chunk_size
-            chunk_tokens = tokens[start:end]
-            
-            chunk_text = self.encoding.decode(chunk_tokens)
-            chunks.append(chunk_text)
-            
-            if end >= len(tokens):
-                break
-            
-            start = end - self.chunk_overlap
+        if len(offsets) <= self.chunk_size:
+            return [text]
         
-        return chunks if chunks else [text]
+        stride = self.chunk_size - self.chunk_overlap
+        return [
+            text[offsets[start][0]:offsets[min(start + self.chunk_size, len(offsets)) - 1][1]]
+            for start in range(0, len(offsets) - self.chunk_overlap, stride)
+        ]
     
     def count_tokens(self, text: str) -> int:
         """
@@ -107,4 +121,4 @@ class TextChunker:
         Returns:
             Number of tokens
         """
-        return len(self.encoding.encode(text))
+        return len(self.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
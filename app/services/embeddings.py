@@ -1,9 +1,19 @@
-import hashlib
-from typing import List
-from sentence_transformers import SentenceTransformer
+import asyncio
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+import blake3
+import onnxruntime as ort
+from transformers import AutoTokenizer
 from diskcache import Cache
 from app.core.config import get_settings
 
+# Embeddings are kept, cached and shipped as float16: half the bytes of float32
+# and far below the precision that cosine ranking needs.
+EMBEDDING_DTYPE = np.float16
+
 
 class EmbeddingService:
     """Handles embedding generation with caching using local sentence-transformers model."""
@@ -11,14 +21,186 @@ class EmbeddingService:
     def __init__(self):
         settings = get_settings()
         self.model_name = settings.embedding_model
+        self.backend = settings.embedding_backend
+        self.max_seq_length = settings.embedding_max_seq_length
+        self.batch_size = settings.embedding_batch_size
+        self.dimension = settings.embedding_dimension
         self.cache = Cache(settings.cache_dir)
+        # Identifies which numerics produced a vector; part of every cache key
+        self.variant = self.backend
+        
+        # Query embeddings are coalesced into micro-batches by a lazily started worker
+        self.micro_batch_size = settings.embedding_micro_batch_size
+        self.micro_batch_wait = settings.embedding_micro_batch_wait_ms / 1000
+        self._micro_batch_queue: Optional["asyncio.Queue[Tuple[str, asyncio.Future]]"] = None
+        self._micro_batch_worker: Optional[asyncio.Task] = None
+        # Encoding runs on worker threads; the model and its fast tokenizer are not
+        # safe to drive from several threads at once
+        self._encode_lock = threading.Lock()
+        
+        # Load the embedding model once at startup
+        print(f"Loading embedding model: {self.model_name} ({self.backend} backend)")
+        if self.backend == "onnx":
+            self._load_onnx_model(Path(settings.onnx_model_dir) / self.model_name.replace("/", "__"))
+        else:
+            # torch is only needed by this backend; ONNX deployments never import it
+            from sentence_transformers import SentenceTransformer
+            
+            self.model = SentenceTransformer(self.model_name)
+            self.model.max_seq_length = self.max_seq_length
+            self.tokenizer = self.model.tokenizer
+            
+            if settings.embedding_quantize and self.model.device.type == "cpu":
+                self._quantize_torch_model()
         
-        # Load the sentence-transformers model once at startup
-        print(f"Loading embedding model: {self.model_name}")
-        self.model = SentenceTransformer(self.model_name)
-        print(f"Embedding model loaded. Dimension: {self.model.get_sentence_embedding_dimension()}")
+        # Longest text the model sees untruncated, once [CLS]/[SEP] are added
+        self.max_input_tokens = self.max_seq_length - self.tokenizer.num_special_tokens_to_add()
+        print(f"Embedding model loaded. Dimension: {self.dimension}")
     
-    async def generate_embedding(self, text: str) -> List[float]:
+    def _quantize_torch_model(self):
+        """Swap the transformer's Linear layers for dynamic INT8 (FBGEMM) kernels."""
+        import torch
+        
+        # INT8 GEMMs scale with cores, but never beyond the CPUs this process is
+        # allowed to run on or torch's own physical-core default
+        if hasattr(os, "sched_getaffinity"):
+            available_cpus = len(os.sched_getaffinity(0))
+        else:
+            available_cpus = os.cpu_count() or 1
+        torch.set_num_threads(min(torch.get_num_threads(), available_cpus))
+        
+        transformer = self.model._first_module()
+        transformer.auto_model = torch.ao.quantization.quantize_dynamic(
+            transformer.auto_model,
+            {torch.nn.Linear},
+            dtype=torch.qint8
+        )
+        self.variant = f"{self.backend}-int8"
+    
+    def _load_onnx_model(self, export_dir: Path):
+        """
+        Load an INT8-quantized ONNX export of the model, exporting it on first use.
+        
+        Args:
+            export_dir: Directory holding the exported model and tokenizer
+        """
+        quantized_path = export_dir / "model_quantized.onnx"
+        
+        if not quantized_path.exists():
+            # optimum is only needed for the one-time export, not for serving
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            
+            print(f"Exporting {self.model_name} to ONNX at {export_dir}")
+            ort_model = ORTModelForFeatureExtraction.from_pretrained(self.model_name, export=True)
+            ort_model.save_pretrained(export_dir)
+            AutoTokenizer.from_pretrained(self.model_name).save_pretrained(export_dir)
+            
+            # Dynamic INT8 quantization of the exported graph (VNNI int8 GEMM on modern CPUs)
+            quantizer = ORTQuantizer.from_pretrained(export_dir)
+            quantizer.quantize(
+                save_dir=export_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+        
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        
+        self.session = ort.InferenceSession(
+            str(quantized_path),
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.session_input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir, use_fast=True)
+    
+    def _encode(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        """
+        Encode texts into embedding vectors with the configured backend.
+        
+        Args:
+            texts: Texts to encode
+            show_progress_bar: Show a progress bar (torch backend only)
+            
+        Returns:
+            Array of shape (len(texts), dimension)
+        """
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        
+        with self._encode_lock:
+            return self._encode_sorted(texts, show_progress_bar)
+    
+    def _encode_sorted(self, texts: List[str], show_progress_bar: bool) -> np.ndarray:
+        """
+        Encode texts in sub-batches of similar token length.
+        
+        Args:
+            texts: Texts to encode
+            show_progress_bar: Show a progress bar (torch backend only)
+            
+        Returns:
+            Array of shape (len(texts), dimension), in the caller's order
+        """
+        # Sort by token length so each sub-batch is padded only to its own longest text
+        token_lengths = [
+            len(input_ids) for input_ids in self.tokenizer(
+                texts,
+                add_special_tokens=False,
+                truncation=True,
+                max_length=self.max_seq_length
+            )["input_ids"]
+        ]
+        order = np.argsort(token_lengths, kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        
+        if self.backend != "onnx":
+            sorted_embeddings = self.model.encode(
+                sorted_texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=show_progress_bar
+            )
+        else:
+            sorted_embeddings = np.concatenate([
+                self._run_onnx(sorted_texts[start:start + self.batch_size])
+                for start in range(0, len(sorted_texts), self.batch_size)
+            ])
+        
+        # Restore the caller's order
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+    
+    def _run_onnx(self, texts: List[str]) -> np.ndarray:
+        """
+        Run one padded batch through the ONNX session.
+        
+        Args:
+            texts: Texts of similar token length
+            
+        Returns:
+            Mean-pooled, L2-normalized embeddings
+        """
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np"
+        )
+        token_embeddings = self.session.run(
+            None,
+            {name: inputs[name].astype(np.int64) for name in self.session_input_names}
+        )[0]
+        
+        # Mean pooling over non-padding tokens, then L2 normalization
+        mask = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+    
+    async def generate_embedding(self, text: str) -> np.ndarray:
         """
         Generate embedding for a single text with caching.
         
@@ -26,27 +208,84 @@ class EmbeddingService:
             text: Text to generate embedding for
             
         Returns:
-            Embedding vector
+            Embedding vector (float16)
         """
         cache_key = self._get_cache_key(text)
         
         cached_embedding = self.cache.get(cache_key)
         if cached_embedding is not None:
-            return cached_embedding
+            return np.frombuffer(cached_embedding, dtype=EMBEDDING_DTYPE)
         
         try:
-            # sentence-transformers encode is synchronous, but we run it in async context
-            embedding = self.model.encode(text, convert_to_numpy=True)
-            embedding_list = embedding.tolist()
+            embedding = (await self._encode_micro_batched(text)).astype(EMBEDDING_DTYPE)
             
-            self.cache.set(cache_key, embedding_list)
+            self.cache.set(cache_key, embedding.tobytes())
             
-            return embedding_list
+            return embedding
             
         except Exception as e:
             raise RuntimeError(f"Failed to generate embedding: {str(e)}")
     
-    async def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+    async def _encode_micro_batched(self, text: str) -> np.ndarray:
+        """
+        Encode one text as part of a micro-batch shared with concurrent callers.
+        
+        Args:
+            text: Text to encode
+            
+        Returns:
+            Embedding vector
+        """
+        if self._micro_batch_worker is None or self._micro_batch_worker.done():
+            self._micro_batch_queue = asyncio.Queue()
+            self._micro_batch_worker = asyncio.create_task(self._run_micro_batches())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._micro_batch_queue.put((text, future))
+        return await future
+    
+    async def _run_micro_batches(self):
+        """Collect queued texts for up to `micro_batch_wait` seconds and encode them together."""
+        loop = asyncio.get_running_loop()
+        queue = self._micro_batch_queue
+        
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.micro_batch_wait
+            
+            while len(batch) < self.micro_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                embeddings = await asyncio.to_thread(self._encode, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                # Callers that were cancelled while waiting have nobody to resolve
+                if not future.done():
+                    future.set_result(embedding)
+    
+    async def aclose(self):
+        """Stop the micro-batching worker."""
+        if self._micro_batch_worker is not None:
+            self._micro_batch_worker.cancel()
+            try:
+                await self._micro_batch_worker
+            except asyncio.CancelledError:
+                pass
+            self._micro_batch_worker = None
+    
+    async def generate_embeddings_batch(self, texts: List[str]) -> np.ndarray:
         """
         Generate embeddings for multiple texts efficiently.
         
@@ -54,48 +293,58 @@ class EmbeddingService:
             texts: List of texts to generate embeddings for
             
         Returns:
-            List of embedding vectors
+            Array of shape (len(texts), dimension) with one float16 row per text
         """
-        embeddings = []
+        embeddings = np.empty((len(texts), self.dimension), dtype=EMBEDDING_DTYPE)
         uncached_texts = []
         uncached_indices = []
         
-        # Check cache first
-        for idx, text in enumerate(texts):
-            cache_key = self._get_cache_key(text)
-            cached_embedding = self.cache.get(cache_key)
-            
-            if cached_embedding is not None:
-                embeddings.append(cached_embedding)
-            else:
-                embeddings.append(None)
-                uncached_texts.append(text)
-                uncached_indices.append(idx)
+        # Hash each text once; the same keys are reused when writing back
+        cache_keys = [self._get_cache_key(text) for text in texts]
+        
+        # Check cache first, in a single SQLite transaction
+        with self.cache.transact(retry=True):
+            for idx, (text, cache_key) in enumerate(zip(texts, cache_keys)):
+                cached_embedding = self.cache.get(cache_key)
+                
+                if cached_embedding is not None:
+                    embeddings[idx] = np.frombuffer(cached_embedding, dtype=EMBEDDING_DTYPE)
+                else:
+                    uncached_texts.append(text)
+                    uncached_indices.append(idx)
         
         # Generate embeddings for uncached texts
         if uncached_texts:
             try:
                 # Batch encode is much faster than encoding one by one
-                batch_embeddings = self.model.encode(
-                    uncached_texts, 
-                    convert_to_numpy=True,
-                    show_progress_bar=True
-                )
+                batch_embeddings = (
+                    await asyncio.to_thread(self._encode, uncached_texts, show_progress_bar=True)
+                ).astype(EMBEDDING_DTYPE)
+                embeddings[uncached_indices] = batch_embeddings
                 
-                for i, embedding in enumerate(batch_embeddings):
-                    embedding_list = embedding.tolist()
-                    original_idx = uncached_indices[i]
-                    embeddings[original_idx] = embedding_list
-                    
-                    # Cache the embedding
-                    cache_key = self._get_cache_key(uncached_texts[i])
-                    self.cache.set(cache_key, embedding_list)
-                    
+                # Cache the new embeddings in a single SQLite transaction
+                with self.cache.transact(retry=True):
+                    for original_idx, embedding in zip(uncached_indices, batch_embeddings):
+                        self.cache.set(cache_keys[original_idx], embedding.tobytes())
+                        
             except Exception as e:
                 raise RuntimeError(f"Failed to generate batch embeddings: {str(e)}")
         
         return embeddings
     
+    def text_digest(self, text: str) -> bytes:
+        """
+        Fingerprint a text for caching and deduplication.
+        
+        Args:
+            text: Text to fingerprint
+            
+        Returns:
+            16-byte digest
+        """
+        # 128-bit BLAKE3 digest: not a security boundary, just a fast, collision-safe key
+        return blake3.blake3(text.encode()).digest(length=16)
+    
     def _get_cache_key(self, text: str) -> str:
         """
         Generate a cache key for a text.
@@ -106,8 +355,9 @@ class EmbeddingService:
         Returns:
             Cache key
         """
-        text_hash = hashlib.sha256(text.encode()).hexdigest()
-        return f"embedding:{self.model_name}:{text_hash}"
+        text_hash = self.text_digest(text).hex()
+        # Backends produce slightly different vectors, so they must not share entries
+        return f"embedding:{self.model_name}:{self.variant}:f16:{text_hash}"
     
     def clear_cache(self):
         """Clear the embedding cache."""
@@ -13,6 +13,11 @@ class PDFProcessor:
             r'^([A-Z][A-Z\s]+)$',
             r'^(Abstract|Introduction|Conclusion|References|Methodology|Results|Discussion)',
         ]
+        # One compiled alternation: a single regex dispatch per text block
+        self._section_re = re.compile(
+            "|".join(f"(?:{pattern})" for pattern in self.section_patterns),
+            re.IGNORECASE
+        )
     
     def extract_text_with_metadata(self, pdf_path: str) -> List[Dict[str, any]]:
         """
@@ -28,33 +33,29 @@ class PDFProcessor:
         current_section = "Unknown"
         
         try:
-            doc = fitz.open(pdf_path)
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                blocks = page.get_text("blocks")
-                
-                page_text = ""
-                for block in blocks:
-                    text = block[4].strip()
-                    if not text:
-                        continue
+            with fitz.open(pdf_path) as doc:
+                for page_num, page in enumerate(doc, 1):
+                    blocks = page.get_text("blocks")
                     
-                    detected_section = self._detect_section(text)
-                    if detected_section:
-                        current_section = detected_section
+                    page_parts = []
+                    for block in blocks:
+                        text = block[4].strip()
+                        if not text:
+                            continue
+                        
+                        detected_section = self._detect_section(text)
+                        if detected_section:
+                            current_section = detected_section
+                        
+                        page_parts.append(text)
                     
-                    page_text += text + "\n"
-                
-                if page_text.strip():
-                    pages_data.append({
-                        "text": page_text.strip(),
-                        "page": page_num + 1,
-                        "section": current_section
-                    })
-            
-            doc.close()
-            
+                    if page_parts:
+                        pages_data.append({
+                            "text": "\n".join(page_parts),
+                            "page": page_num,
+                            "section": current_section
+                        })
+                        
         except Exception as e:
             raise ValueError(f"Failed to process PDF: {str(e)}")
         
@@ -75,10 +76,8 @@ class PDFProcessor:
         if len(text) > 100 or len(text) < 3:
             return None
         
-        for pattern in self.section_patterns:
-            match = re.match(pattern, text, re.IGNORECASE)
-            if match:
-                return text.title() if text.isupper() else text
+        if self._section_re.match(text):
+            return text.title() if text.isupper() else text
         
         return None
     
@@ -0,0 +1,187 @@
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+import hnswlib
+import numpy as np
+from app.models.schemas import QueryResponse
+
+# Upper bound for region-adaptive thresholds. Identical questions embedded as
+# float16 rarely come back at exactly 1.0, so a threshold of 1.0 would never hit.
+MAX_THRESHOLD = 0.999
+
+
+@dataclass
+class CacheEntry:
+    """A cached answer together with the scope it is valid for."""
+    document_id: str
+    top_k: int
+    response: QueryResponse
+    threshold: float
+    expires_at: float
+
+
+class QueryCache:
+    """Semantic cache mapping recent question embeddings to their answers."""
+    
+    def __init__(
+        self,
+        dimension: int,
+        max_entries: int = 1024,
+        similarity_threshold: float = 0.97,
+        ttl_seconds: float = 300,
+        candidates: int = 8,
+        threshold_margin: float = 0.01
+    ):
+        """
+        Initialize the cache.
+        
+        Args:
+            dimension: Embedding dimension
+            max_entries: Maximum number of cached questions (LRU eviction beyond this)
+            similarity_threshold: Base cosine similarity required for a hit
+            ttl_seconds: Lifetime of a cached answer
+            candidates: Number of nearest neighbours inspected per lookup
+            threshold_margin: How far above a distinct neighbour's similarity
+                the threshold is raised in dense regions
+        """
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.candidates = candidates
+        self.threshold_margin = threshold_margin
+        
+        self.index = hnswlib.Index(space="cosine", dim=dimension)
+        self.index.init_index(
+            max_elements=max_entries,
+            ef_construction=100,
+            M=16,
+            allow_replace_deleted=True
+        )
+        self.index.set_ef(64)
+        
+        self.entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        # Live entries per (document_id, top_k); bounds k for scoped lookups
+        self._scope_sizes: "Counter[Tuple[str, int]]" = Counter()
+        self._next_label = 0
+    
+    def get(self, embedding: np.ndarray, document_id: str, top_k: int) -> Optional[QueryResponse]:
+        """
+        Look up a cached answer for a semantically equivalent question.
+        
+        Args:
+            embedding: Question embedding
+            document_id: Document the question is asked against
+            top_k: Number of chunks the answer was built from
+            
+        Returns:
+            Cached QueryResponse on a hit, None otherwise
+        """
+        for label, similarity, entry in self._neighbours(embedding, document_id, top_k):
+            if similarity >= entry.threshold:
+                self.entries.move_to_end(label)
+                return entry.response
+        
+        return None
+    
+    def put(self, embedding: np.ndarray, document_id: str, top_k: int, response: QueryResponse):
+        """
+        Cache the answer to a question.
+        
+        Args:
+            embedding: Question embedding
+            document_id: Document the question was asked against
+            top_k: Number of chunks the answer was built from
+            response: Generated answer
+        """
+        # Region-adaptive threshold: a distinct question that was close but missed
+        # means this region is dense, so both entries demand a closer match.
+        threshold = self.similarity_threshold
+        for _, similarity, entry in self._neighbours(embedding, document_id, top_k):
+            if similarity >= entry.threshold:
+                # A concurrent request already cached an equivalent question
+                return
+            raised = min(MAX_THRESHOLD, similarity + self.threshold_margin)
+            threshold = max(threshold, raised)
+            entry.threshold = max(entry.threshold, raised)
+        
+        while len(self.entries) >= self.max_entries:
+            self._evict(next(iter(self.entries)))
+        
+        label = self._next_label
+        self._next_label += 1
+        
+        self.index.add_items(
+            np.asarray(embedding, dtype=np.float32).reshape(1, -1),
+            np.array([label]),
+            replace_deleted=True
+        )
+        self.entries[label] = CacheEntry(
+            document_id=document_id,
+            top_k=top_k,
+            response=response,
+            threshold=threshold,
+            expires_at=time.monotonic() + self.ttl_seconds
+        )
+        self._scope_sizes[(document_id, top_k)] += 1
+    
+    def _neighbours(self, embedding: np.ndarray, document_id: str, top_k: int):
+        """
+        Yield live nearest neighbours of an embedding within one (document, top_k)
+        scope, evicting expired ones.
+        
+        Args:
+            embedding: Query embedding
+            document_id: Document the question is asked against
+            top_k: Number of chunks the answer is built from
+            
+        Yields:
+            Tuples of (label, cosine similarity, entry), closest first
+        """
+        scope_size = self._scope_sizes[(document_id, top_k)]
+        if not scope_size:
+            return
+        
+        def in_scope(label: int) -> bool:
+            entry = self.entries.get(label)
+            return entry is not None and entry.document_id == document_id and entry.top_k == top_k
+        
+        # Filtering inside the graph search keeps other documents' questions from
+        # crowding this scope out of the candidate list
+        try:
+            labels, distances = self.index.knn_query(
+                np.asarray(embedding, dtype=np.float32).reshape(1, -1),
+                k=min(self.candidates, scope_size),
+                num_threads=1,
+                filter=in_scope
+            )
+        except RuntimeError:
+            # The search reached fewer than k scope members; treat as a miss
+            return
+        
+        now = time.monotonic()
+        for label, distance in zip(labels[0].tolist(), distances[0].tolist()):
+            entry = self.entries.get(label)
+            if entry is None:
+                continue
+            
+            if entry.expires_at <= now:
+                self._evict(label)
+                continue
+            
+            yield label, 1.0 - distance, entry
+    
+    def _evict(self, label: int):
+        """
+        Remove one cached answer.
+        
+        Args:
+            label: Index label of the entry
+        """
+        entry = self.entries.pop(label)
+        self.index.mark_deleted(label)
+        
+        scope = (entry.document_id, entry.top_k)
+        self._scope_sizes[scope] -= 1
+        if not self._scope_sizes[scope]:
+            del self._scope_sizes[scope]
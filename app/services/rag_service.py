@@ -1,12 +1,18 @@
+import asyncio
+import copy
 import uuid
-from typing import List
+from contextlib import suppress
+from itertools import islice
+from typing import List, Dict, Tuple, Optional, AsyncIterator
+import numpy as np
 from pathlib import Path
 from app.services.pdf_processor import PDFProcessor
 from app.services.chunker import TextChunker
 from app.services.embeddings import EmbeddingService
-from app.services.vector_store import VectorStore
+from app.services.vector_store import get_vector_store
 from app.services.answer_generator import AnswerGenerator
-from app.models.schemas import UploadResponse, QueryRequest, QueryResponse, DocumentChunk
+from app.services.query_cache import QueryCache
+from app.models.schemas import UploadResponse, QueryRequest, QueryResponse, DocumentChunk, SearchHit
 from app.core.config import get_settings
 
 
@@ -16,15 +22,34 @@ class RAGService:
     def __init__(self):
         settings = get_settings()
         self.pdf_processor = PDFProcessor()
+        self.embedding_service = EmbeddingService()
+        # Chunk with the embedding model's own tokenizer, never past its input limit
         self.chunker = TextChunker(
-            chunk_size=settings.chunk_size,
+            # Own copy: the embedding service drives its tokenizer from worker threads
+            tokenizer=copy.deepcopy(self.embedding_service.tokenizer),
+            chunk_size=min(settings.chunk_size, self.embedding_service.max_input_tokens),
             chunk_overlap=settings.chunk_overlap
         )
-        self.embedding_service = EmbeddingService()
-        self.vector_store = VectorStore()
+        self.vector_store = get_vector_store()
         self.answer_generator = AnswerGenerator()
+        self.query_cache = QueryCache(
+            dimension=settings.embedding_dimension,
+            max_entries=settings.query_cache_max_entries,
+            similarity_threshold=settings.query_cache_similarity_threshold,
+            ttl_seconds=settings.query_cache_ttl_seconds
+        ) if settings.query_cache_enabled else None
         self.settings = settings
     
+    async def startup(self):
+        """Make sure the vector store's collection exists before serving requests."""
+        await self.vector_store.ensure_collection()
+    
+    async def aclose(self):
+        """Release network clients and background workers held by the pipeline."""
+        await self.answer_generator.aclose()
+        await self.embedding_service.aclose()
+        await self.vector_store.close()
+    
     async def upload_document(self, file_path: str) -> UploadResponse:
         """
         Process and index a PDF document.
@@ -35,7 +60,9 @@ class RAGService:
         Returns:
             UploadResponse with document ID and status
         """
-        is_valid, error_msg = self.pdf_processor.validate_pdf(
+        # PDF parsing is blocking; keep it off the event loop
+        is_valid, error_msg = await asyncio.to_thread(
+            self.pdf_processor.validate_pdf,
             file_path, 
             self.settings.max_pdf_size_mb
         )
@@ -51,17 +78,65 @@ class RAGService:
                 status="indexed"
             )
         
-        pages_data = self.pdf_processor.extract_text_with_metadata(file_path)
-        
-        chunks = self.chunker.chunk_pages(pages_data, document_id)
+        pages_data = await asyncio.to_thread(
+            self.pdf_processor.extract_text_with_metadata,
+            file_path
+        )
         
-        texts = [chunk.text for chunk in chunks]
-        embeddings = await self.embedding_service.generate_embeddings_batch(texts)
+        # Chunk, embed and store in fixed-size batches so the whole document
+        # never has to be materialized; each batch is stored while the next
+        # one is chunked and embedded.
+        chunk_stream = self.chunker.chunk_pages(pages_data, document_id)
+        store_task = None
         
-        for chunk, embedding in zip(chunks, embeddings):
-            chunk.embedding = embedding
+        # Repeated headers, footers and boilerplate are embedded once per document;
+        # keyed by digest so only 16-byte keys stay resident, not every chunk's text
+        embeddings_by_digest: Dict[bytes, np.ndarray] = {}
         
-        await self.vector_store.store_chunks(chunks)
+        # Documents spanning several batches pause indexing so Qdrant indexes once
+        # after loading rather than continuously while loading
+        bulk_load = False
+        try:
+            while chunks := list(islice(chunk_stream, self.settings.ingest_batch_size)):
+                digests = [self.embedding_service.text_digest(chunk.text) for chunk in chunks]
+                new_texts = {
+                    digest: chunk.text
+                    for digest, chunk in zip(digests, chunks)
+                    if digest not in embeddings_by_digest
+                }
+                if new_texts:
+                    embeddings = await self.embedding_service.generate_embeddings_batch(list(new_texts.values()))
+                    embeddings_by_digest.update(zip(new_texts, embeddings))
+                
+                for digest, chunk in zip(digests, chunks):
+                    chunk.embedding = embeddings_by_digest[digest]
+                
+                if store_task is not None:
+                    # Shielded: a cancelled upload must not abandon a store mid-flight
+                    await asyncio.shield(store_task)
+                    if not bulk_load:
+                        await self.vector_store.begin_bulk()
+                        bulk_load = True
+                store_task = asyncio.create_task(self.vector_store.store_chunks(chunks))
+            
+            if store_task is not None:
+                await asyncio.shield(store_task)
+                
+        except BaseException:
+            # Earlier batches are already in Qdrant under an id the client never
+            # receives. Stores may be running in worker threads and can't be
+            # cancelled, so let the last one settle before deleting the document.
+            if store_task is not None:
+                with suppress(Exception, asyncio.CancelledError):
+                    await store_task
+            try:
+                await self.vector_store.delete_document(document_id)
+            except Exception as e:
+                print(f"Failed to remove partially indexed document {document_id}: {e}")
+            raise
+        finally:
+            if bulk_load:
+                await self.vector_store.end_bulk()
         
         return UploadResponse(
             document_id=document_id,
@@ -78,21 +153,96 @@ class RAGService:
         Returns:
             QueryResponse with answer and citations
         """
-        if not await self.vector_store.document_exists(request.document_id):
-            raise ValueError(f"Document {request.document_id} not found")
+        query_embedding, cached_response, retrieved_chunks = await self._retrieve(request)
+        if cached_response is not None:
+            return cached_response
+        
+        response = await self.answer_generator.generate_answer(
+            question=request.question,
+            retrieved_chunks=retrieved_chunks
+        )
+        
+        if self.query_cache is not None:
+            self.query_cache.put(query_embedding, request.document_id, request.top_k, response)
+        
+        return response
+    
+    async def stream_query(self, request: QueryRequest) -> AsyncIterator[Dict]:
+        """
+        Query a document and stream the answer as it is generated.
+        
+        Retrieval happens before this returns, so a missing document raises
+        here rather than in the middle of the stream.
+        
+        Args:
+            request: QueryRequest with document_id, question, and top_k
+            
+        Returns:
+            Async iterator of {"token": str} events followed by a final
+            {"citations": [...], "done": True} event
+        """
+        query_embedding, cached_response, retrieved_chunks = await self._retrieve(request)
+        if cached_response is not None:
+            return self._replay_response(cached_response)
+        
+        return self._stream_and_cache(request, query_embedding, retrieved_chunks)
+    
+    async def _retrieve(
+        self, 
+        request: QueryRequest
+    ) -> Tuple[np.ndarray, Optional[QueryResponse], List[SearchHit]]:
+        """
+        Embed the question and either hit the query cache or retrieve chunks.
         
+        Args:
+            request: QueryRequest with document_id, question, and top_k
+            
+        Returns:
+            Tuple of (query embedding, cached response or None, retrieved chunks)
+        """
         query_embedding = await self.embedding_service.generate_embedding(request.question)
         
+        # A near-duplicate question on the same document skips retrieval and the LLM
+        if self.query_cache is not None:
+            cached_response = self.query_cache.get(query_embedding, request.document_id, request.top_k)
+            if cached_response is not None:
+                return query_embedding, cached_response, []
+        
+        if not await self.vector_store.document_exists(request.document_id):
+            raise ValueError(f"Document {request.document_id} not found")
+        
         retrieved_chunks = await self.vector_store.search(
             query_embedding=query_embedding,
             document_id=request.document_id,
             top_k=request.top_k,
-            score_threshold=None  # Don't filter at Qdrant level, filter in answer_generator
+            score_threshold=self.settings.similarity_threshold
         )
         
-        response = await self.answer_generator.generate_answer(
-            question=request.question,
-            retrieved_chunks=retrieved_chunks
-        )
+        return query_embedding, None, retrieved_chunks
+    
+    async def _stream_and_cache(
+        self, 
+        request: QueryRequest, 
+        query_embedding: np.ndarray, 
+        retrieved_chunks: List[SearchHit]
+    ) -> AsyncIterator[Dict]:
+        """Relay streamed answer events and cache the completed answer."""
+        answer_parts = []
         
-        return response
+        async for event in self.answer_generator.stream_answer(request.question, retrieved_chunks):
+            if "token" in event:
+                answer_parts.append(event["token"])
+            elif self.query_cache is not None:
+                response = QueryResponse(
+                    answer="".join(answer_parts).strip(),
+                    citations=event["citations"]
+                )
+                self.query_cache.put(query_embedding, request.document_id, request.top_k, response)
+            
+            yield event
+    
+    @staticmethod
+    async def _replay_response(response: QueryResponse) -> AsyncIterator[Dict]:
+        """Replay a cached answer as stream events."""
+        yield {"token": response.answer}
+        yield {"citations": [citation.model_dump() for citation in response.citations], "done": True}
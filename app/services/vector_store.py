@@ -1,15 +1,45 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List, Dict, Optional
-from qdrant_client import QdrantClient
+import httpx
+import numpy as np
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.models import (
     VectorParams, 
     Distance, 
-    PointStruct,
+    Batch,
     Filter,
     FieldCondition,
-    MatchValue
+    MatchValue,
+    HnswConfigDiff,
+    OptimizersConfigDiff,
+    PayloadSchemaType,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    QuantizationSearchParams
 )
 from app.core.config import get_settings
-from app.models.schemas import DocumentChunk
+from app.models.schemas import DocumentChunk, SearchHit
+
+logger = logging.getLogger(__name__)
+
+# Qdrant's default: segments above this size (KB) get an HNSW index. Restored
+# after a bulk load when the collection reports no (or a disabled) threshold.
+INDEXING_THRESHOLD_KB = 20000
+
+# Point IDs are UUIDv5 names under this namespace (see _point_id)
+POINT_ID_NAMESPACE = uuid.NAMESPACE_URL
+
+# Per-document chunk counts remembered for choosing exact vs. HNSW search
+DOCUMENT_SIZE_CACHE_SIZE = 1024
+
+# Payload fields a search hit carries back to the answer generator
+SEARCH_PAYLOAD_FIELDS = ["text", "section", "page", "chunk_index"]
 
 
 class VectorStore:
@@ -17,27 +47,147 @@ class VectorStore:
     
     def __init__(self):
         settings = get_settings()
-        self.client = QdrantClient(
+        self.client = AsyncQdrantClient(
             host=settings.qdrant_host,
-            port=settings.qdrant_port
+            port=settings.qdrant_port,
+            grpc_port=settings.qdrant_grpc_port,
+            prefer_grpc=settings.qdrant_prefer_grpc,
+            # Connection pool for the REST transport (gRPC multiplexes one channel)
+            limits=httpx.Limits(
+                max_connections=settings.qdrant_pool_size,
+                max_keepalive_connections=settings.qdrant_pool_size
+            )
         )
+        self._settings = settings
         self.collection_name = settings.qdrant_collection_name
-        self._ensure_collection()
+        self.upsert_batch_size = settings.qdrant_upsert_batch_size
+        # Shared across uploads so concurrent documents don't multiply the load
+        self._upsert_semaphore = asyncio.Semaphore(settings.qdrant_upsert_concurrency)
+        self.hnsw_ef = settings.hnsw_ef
+        self.exact_search_threshold = settings.exact_search_threshold
+        self._document_sizes: "OrderedDict[str, int]" = OrderedDict()
+        # Number of uploads currently holding indexing off (see begin_bulk)
+        self._bulk_loads = 0
+        self._bulk_lock = asyncio.Lock()
+        self._saved_indexing_threshold = INDEXING_THRESHOLD_KB
+        # The collection is checked once per process, not once per caller
+        self._init_lock = asyncio.Lock()
+        self._ready = False
     
-    def _ensure_collection(self):
-        """Create collection if it doesn't exist."""
-        settings = get_settings()
-        collections = self.client.get_collections().collections
-        collection_names = [col.name for col in collections]
+    async def close(self):
+        """Close the Qdrant client's connections."""
+        await self.client.close()
+    
+    async def ensure_collection(self):
+        """Create collection if it doesn't exist (once; later calls return immediately)."""
+        if self._ready:
+            return
         
-        if self.collection_name not in collection_names:
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=VectorParams(
-                    size=settings.embedding_dimension,  # 384 for all-MiniLM-L6-v2
-                    distance=Distance.COSINE
+        async with self._init_lock:
+            if self._ready:
+                return
+            await self._create_collection_if_missing()
+            self._ready = True
+    
+    async def _create_collection_if_missing(self):
+        """Create the collection and its payload index if they don't exist."""
+        settings = self._settings
+        # One round trip on either transport; the lock in ensure_collection covers
+        # this process, the retry below covers other workers starting at once
+        if not await self.client.collection_exists(self.collection_name):
+            try:
+                await self.client.create_collection(
+                    collection_name=self.collection_name,
+                    vectors_config=VectorParams(
+                        size=settings.embedding_dimension,  # 384 for all-MiniLM-L6-v2
+                        distance=Distance.COSINE,
+                        # Full-precision vectors are only read to rescore the final candidates
+                        on_disk=True
+                    ),
+                    hnsw_config=HnswConfigDiff(
+                        m=settings.hnsw_m,
+                        ef_construct=settings.hnsw_ef_construct
+                    ),
+                    # INT8 copies of the vectors stay in RAM for fast scoring
+                    quantization_config=ScalarQuantization(
+                        scalar=ScalarQuantizationConfig(
+                            type=ScalarType.INT8,
+                            # Clip the outermost 1% of values so they don't stretch the int8 range
+                            quantile=0.99,
+                            always_ram=True
+                        )
+                    )
                 )
-            )
+            except Exception:
+                # Lost a create race with another worker: fine if the collection is there now
+                if not await self.client.collection_exists(self.collection_name):
+                    raise
+        
+        # Every search, existence check and delete filters on document_id.
+        # Creating an index that already exists is a no-op, so older collections get it too.
+        await self.client.create_payload_index(
+            collection_name=self.collection_name,
+            field_name="document_id",
+            field_schema=PayloadSchemaType.KEYWORD
+        )
+    
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _doc_filter(document_id: str) -> Filter:
+        """
+        Build (once per document) the filter that scopes a request to one document.
+        
+        Args:
+            document_id: Document identifier
+            
+        Returns:
+            Filter matching the document's points
+        """
+        return Filter(
+            must=[
+                FieldCondition(
+                    key="document_id",
+                    match=MatchValue(value=document_id)
+                )
+            ]
+        )
+    
+    async def begin_bulk(self):
+        """
+        Pause HNSW indexing so a bulk load doesn't rebuild the graph continuously.
+        
+        The indexing threshold is a collection-wide setting but the reference count
+        lives in this process: with several uvicorn workers, one worker's end_bulk
+        resumes indexing during another worker's load. That only costs indexing
+        work, never correctness, but the toggle assumes a single worker.
+        """
+        async with self._bulk_lock:
+            if self._bulk_loads == 0:
+                info = await self.client.get_collection(self.collection_name)
+                current = info.config.optimizer_config.indexing_threshold
+                # 0 here is a bulk load that never finished, not an operator choice
+                self._saved_indexing_threshold = current or INDEXING_THRESHOLD_KB
+                await self._set_indexing_threshold(0)
+            self._bulk_loads += 1
+    
+    async def end_bulk(self):
+        """Restore the collection's indexing threshold once the last concurrent bulk load finishes."""
+        async with self._bulk_lock:
+            self._bulk_loads -= 1
+            if self._bulk_loads == 0:
+                await self._set_indexing_threshold(self._saved_indexing_threshold)
+    
+    async def _set_indexing_threshold(self, threshold_kb: int):
+        """
+        Update the collection's indexing threshold.
+        
+        Args:
+            threshold_kb: Segment size above which points are indexed; 0 disables indexing
+        """
+        await self.client.update_collection(
+            collection_name=self.collection_name,
+            optimizers_config=OptimizersConfigDiff(indexing_threshold=threshold_kb)
+        )
     
     async def store_chunks(self, chunks: List[DocumentChunk]):
         """
@@ -49,41 +199,84 @@ class VectorStore:
         if not chunks:
             return
         
-        points = []
-        for idx, chunk in enumerate(chunks):
-            if chunk.embedding is None:
-                raise ValueError(f"Chunk {idx} is missing embedding")
-            
-            # Use chunk_index as ID (unsigned integer) as Qdrant requires
-            # Store document_id in payload for filtering
-            point = PointStruct(
-                id=chunk.metadata.chunk_index,
-                vector=chunk.embedding,
-                payload={
-                    "document_id": chunk.metadata.document_id,
-                    "section": chunk.metadata.section,
-                    "page": chunk.metadata.page,
-                    "chunk_index": chunk.metadata.chunk_index,
-                    "text": chunk.text
-                }
+        # Validate in one scan up front so the build loop below is branch-free
+        missing_idx = next((idx for idx, chunk in enumerate(chunks) if chunk.embedding is None), None)
+        if missing_idx is not None:
+            raise ValueError(f"Chunk {missing_idx} is missing embedding")
+        
+        # One contiguous float32 block per batch; rows are unboxed only when sent
+        vectors = np.asarray([chunk.embedding for chunk in chunks], dtype=np.float32)
+        
+        # Columnar (SoA) form: ids, vectors and payloads travel as parallel arrays
+        ids = []
+        payloads = []
+        for chunk in chunks:
+            ids.append(self._point_id(chunk.metadata.document_id, chunk.metadata.chunk_index))
+            # Store document_id in payload for filtering. Qdrant has no payload shared
+            # by a group of points; a later set_payload would resend every point id and
+            # leave the points unfilterable until it lands.
+            payloads.append({
+                "document_id": chunk.metadata.document_id,
+                "section": chunk.metadata.section,
+                "page": chunk.metadata.page,
+                "chunk_index": chunk.metadata.chunk_index,
+                "text": chunk.text
+            })
+        
+        # Bounded requests keep payloads small; a few in flight overlap network and indexing
+        await asyncio.gather(*(
+            self._upsert_batch(
+                ids[start:start + self.upsert_batch_size],
+                vectors[start:start + self.upsert_batch_size],
+                payloads[start:start + self.upsert_batch_size]
             )
-            points.append(point)
+            for start in range(0, len(chunks), self.upsert_batch_size)
+        ))
+    
+    async def _upsert_batch(self, ids: List[str], vectors: np.ndarray, payloads: List[Dict]):
+        """
+        Upsert one columnar batch, limited to `qdrant_upsert_concurrency` in flight.
         
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=points
-        )
+        Args:
+            ids: Point IDs
+            vectors: Float32 vectors, one row per point
+            payloads: Payloads, one per point
+        """
+        async with self._upsert_semaphore:
+            await self.client.upsert(
+                collection_name=self.collection_name,
+                points=Batch(ids=ids, vectors=vectors.tolist(), payloads=payloads)
+            )
+    
+    @staticmethod
+    def _point_id(document_id: str, chunk_index: int) -> str:
+        """
+        Derive a stable point ID, so re-uploading a chunk overwrites it in place.
+        
+        Args:
+            document_id: Document identifier
+            chunk_index: Chunk identifier within the document
+            
+        Returns:
+            UUID string (Qdrant accepts UUIDs as point IDs)
+        """
+        return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{document_id}:{chunk_index}"))
     
     async def search(
         self, 
-        query_embedding: List[float],
+        query_embedding: np.ndarray,
         document_id: str,
         top_k: int = 5,
         score_threshold: Optional[float] = None
-    ) -> List[Dict]:
+    ) -> List[SearchHit]:
         """
         Search for similar chunks in the vector database.
         
+        Documents below `exact_search_threshold` chunks are scored exactly. Qdrant's
+        own HNSW `full_scan_threshold` (in KB of vectors) already switches filtered
+        searches with a small estimated cardinality to brute force; this makes the
+        choice explicit and in chunks.
+        
         Args:
             query_embedding: Query vector
             document_id: Filter by document ID
@@ -91,37 +284,45 @@ class VectorStore:
             score_threshold: Minimum similarity score threshold
             
         Returns:
-            List of search results with metadata and scores
+            List of SearchHits with metadata and scores
         """
-        print(f"Searching for document_id: {document_id}")
+        logger.debug("Searching document_id=%s", document_id)
         
-        query_filter = Filter(
-            must=[
-                FieldCondition(
-                    key="document_id",
-                    match=MatchValue(value=document_id)
-                )
-            ]
-        )
+        if await self._document_size(document_id) < self.exact_search_threshold:
+            # A filtered HNSW walk over a small document rejects most of the graph;
+            # scoring its few hundred vectors directly is faster and exact
+            search_params = SearchParams(exact=True)
+        else:
+            # Score on the quantized vectors, then rescore the top hits at full precision
+            search_params = SearchParams(
+                hnsw_ef=self.hnsw_ef,
+                # Fetch 2x top_k quantized candidates so rescoring can recover recall
+                quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+            )
         
-        results = self.client.search(
+        response = await self.client.query_points(
             collection_name=self.collection_name,
-            query_vector=query_embedding,
-            query_filter=query_filter,
+            query=query_embedding,
+            query_filter=self._doc_filter(document_id),
             limit=top_k,
-            score_threshold=score_threshold
+            score_threshold=score_threshold,
+            search_params=search_params,
+            # document_id is already known to the caller; vectors are never needed
+            with_payload=SEARCH_PAYLOAD_FIELDS,
+            with_vectors=False
         )
+        results = response.points
         
-        print(f"Found {len(results)} results from Qdrant")
+        logger.debug("Found %d results from Qdrant", len(results))
         
         return [
-            {
-                "text": result.payload["text"],
-                "section": result.payload["section"],
-                "page": result.payload["page"],
-                "chunk_index": result.payload["chunk_index"],
-                "score": result.score
-            }
+            SearchHit(
+                result.payload["text"],
+                result.payload["section"],
+                result.payload["page"],
+                result.payload["chunk_index"],
+                result.score
+            )
             for result in results
         ]
     
@@ -129,28 +330,64 @@ class VectorStore:
         """
         Check if a document exists in the vector store.
         
+        Always asks Qdrant: another worker may have deleted the document since
+        this process last saw it.
+        
         Args:
             document_id: Document identifier
             
         Returns:
             True if document exists, False otherwise
         """
-        query_filter = Filter(
-            must=[
-                FieldCondition(
-                    key="document_id",
-                    match=MatchValue(value=document_id)
-                )
-            ]
-        )
+        return await self._count_document(document_id) > 0
+    
+    async def _document_size(self, document_id: str) -> int:
+        """
+        Get a document's chunk count, from the last count seen if there is one.
+        
+        Only used to choose between exact and HNSW search, where a stale count
+        costs at most a slower search, never a wrong answer.
+        
+        Args:
+            document_id: Document identifier
+            
+        Returns:
+            Number of stored chunks for the document
+        """
+        size = self._document_sizes.get(document_id)
+        if size is not None:
+            self._document_sizes.move_to_end(document_id)
+            return size
+        
+        return await self._count_document(document_id)
+    
+    async def _count_document(self, document_id: str) -> int:
+        """
+        Count a document's chunks in Qdrant and remember the result.
         
-        results = self.client.scroll(
+        Args:
+            document_id: Document identifier
+            
+        Returns:
+            Number of stored chunks for the document
+        """
+        # Approximate count is answered from the document_id payload index
+        # (exact for a single indexed match) without fetching any point
+        result = await self.client.count(
             collection_name=self.collection_name,
-            scroll_filter=query_filter,
-            limit=1
+            count_filter=self._doc_filter(document_id),
+            exact=False
         )
         
-        return len(results[0]) > 0
+        if result.count:
+            self._document_sizes[document_id] = result.count
+            self._document_sizes.move_to_end(document_id)
+            if len(self._document_sizes) > DOCUMENT_SIZE_CACHE_SIZE:
+                self._document_sizes.popitem(last=False)
+        else:
+            self._document_sizes.pop(document_id, None)
+        
+        return result.count
     
     async def delete_document(self, document_id: str):
         """
@@ -159,25 +396,25 @@ class VectorStore:
         Args:
             document_id: Document identifier
         """
-        query_filter = Filter(
-            must=[
-                FieldCondition(
-                    key="document_id",
-                    match=MatchValue(value=document_id)
-                )
-            ]
-        )
-        
-        self.client.delete(
+        await self.client.delete(
             collection_name=self.collection_name,
-            points_selector=query_filter
+            points_selector=self._doc_filter(document_id)
         )
+        self._document_sizes.pop(document_id, None)
     
-    def reset_collection(self):
+    async def reset_collection(self):
         """Delete and recreate the collection."""
         try:
-            self.client.delete_collection(collection_name=self.collection_name)
+            await self.client.delete_collection(collection_name=self.collection_name)
         except Exception:
             pass
         
-        self._ensure_collection()
+        self._document_sizes.clear()
+        self._ready = False
+        await self.ensure_collection()
+
+
+@lru_cache()
+def get_vector_store() -> VectorStore:
+    """Get the shared vector store, so all callers reuse one client and its connections."""
+    return VectorStore()
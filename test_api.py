@@ -3,19 +3,25 @@
 Test script for the RAG Research Paper AI Assistant API.
 
 Usage:
-    python test_api.py path/to/paper.pdf "Your question here"
+    python test_api.py path/to/paper.pdf "Your question here" [top_k] [-n N]
+
+With -n, the question is sent N times concurrently over one shared client,
+which doubles as a quick load test.
 """
 
+import argparse
+import asyncio
 import sys
-import requests
-import json
+import time
+import httpx
 from pathlib import Path
+from typing import Dict, Tuple
 
 
 API_BASE_URL = "http://localhost:8000"
 
 
-def upload_document(pdf_path: str) -> str:
+async def upload_document(client: httpx.AsyncClient, pdf_path: str) -> str:
     """Upload a PDF document and return the document ID."""
     print(f"Uploading document: {pdf_path}")
     
@@ -23,9 +29,9 @@ def upload_document(pdf_path: str) -> str:
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
     
     with open(pdf_path, "rb") as f:
-        response = requests.post(
-            f"{API_BASE_URL}/upload",
-            files={"file": f}
+        response = await client.post(
+            "/upload",
+            files={"file": (Path(pdf_path).name, f, "application/pdf")}
         )
     
     if response.status_code != 201:
@@ -39,25 +45,32 @@ def upload_document(pdf_path: str) -> str:
     return document_id
 
 
-def query_document(document_id: str, question: str, top_k: int = 5):
-    """Query a document with a question."""
-    print(f"\nQuerying document: {document_id}")
-    print(f"Question: {question}")
-    
-    response = requests.post(
-        f"{API_BASE_URL}/query",
+async def query_document(
+    client: httpx.AsyncClient,
+    document_id: str,
+    question: str,
+    top_k: int = 5
+) -> Tuple[Dict, float]:
+    """Query a document with a question; returns the response data and latency in seconds."""
+    start = time.perf_counter()
+    response = await client.post(
+        "/query",
         json={
             "document_id": document_id,
             "question": question,
             "top_k": top_k
         }
     )
+    latency = time.perf_counter() - start
     
     if response.status_code != 200:
         raise Exception(f"Query failed: {response.text}")
     
-    data = response.json()
-    
+    return response.json(), latency
+
+
+def print_answer(data: Dict):
+    """Print an answer and its citations."""
     print("\n" + "="*80)
     print("ANSWER")
     print("="*80)
@@ -76,10 +89,10 @@ def query_document(document_id: str, question: str, top_k: int = 5):
     print("\n" + "="*80)
 
 
-def check_health():
+async def check_health(client: httpx.AsyncClient) -> bool:
     """Check if the API is healthy."""
     try:
-        response = requests.get(f"{API_BASE_URL}/health")
+        response = await client.get("/health")
         if response.status_code == 200:
             print("✓ API is healthy and running")
             return True
@@ -91,34 +104,63 @@ def check_health():
         return False
 
 
+async def run_all(pdf_path: str, question: str, top_k: int, concurrency: int):
+    """Upload the document, then send the question `concurrency` times at once."""
+    # One client for every request: connections are pooled and reused
+    async with httpx.AsyncClient(
+        base_url=API_BASE_URL,
+        timeout=300.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    ) as client:
+        if not await check_health(client):
+            print("\nPlease ensure the API is running:")
+            print("  docker-compose up")
+            print("  OR")
+            print("  uvicorn app.main:app --reload")
+            sys.exit(1)
+        
+        try:
+            document_id = await upload_document(client, pdf_path)
+            
+            print(f"\nQuerying document: {document_id}")
+            print(f"Question: {question}")
+            
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                query_document(client, document_id, question, top_k)
+                for _ in range(concurrency)
+            ))
+            elapsed = time.perf_counter() - start
+            
+            print_answer(results[0][0])
+            
+            if concurrency > 1:
+                latencies = sorted(latency for _, latency in results)
+                print(f"{concurrency} concurrent queries in {elapsed:.2f}s "
+                      f"({concurrency / elapsed:.2f} queries/s)")
+                print(f"  Latency p50: {latencies[len(latencies) // 2]:.2f}s, "
+                      f"max: {latencies[-1]:.2f}s")
+            
+        except Exception as e:
+            print(f"\n✗ Error: {e}")
+            sys.exit(1)
+
+
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python test_api.py <pdf_path> <question> [top_k]")
-        print("\nExample:")
-        print('  python test_api.py paper.pdf "What is the main contribution?"')
-        sys.exit(1)
-    
-    pdf_path = sys.argv[1]
-    question = sys.argv[2]
-    top_k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    parser = argparse.ArgumentParser(
+        description="Upload a paper and ask it a question.",
+        epilog='Example: python test_api.py paper.pdf "What is the main contribution?"'
+    )
+    parser.add_argument("pdf_path", help="PDF to upload")
+    parser.add_argument("question", help="Question to ask about the paper")
+    parser.add_argument("top_k", nargs="?", type=int, default=5, help="Chunks to retrieve (default: 5)")
+    parser.add_argument("-n", type=int, default=1, help="Number of concurrent queries (default: 1)")
+    args = parser.parse_args()
     
     print("RAG Research Paper AI Assistant - Test Script")
     print("="*80)
     
-    if not check_health():
-        print("\nPlease ensure the API is running:")
-        print("  docker-compose up")
-        print("  OR")
-        print("  uvicorn app.main:app --reload")
-        sys.exit(1)
-    
-    try:
-        document_id = upload_document(pdf_path)
-        query_document(document_id, question, top_k)
-        
-    except Exception as e:
-        print(f"\n✗ Error: {e}")
-        sys.exit(1)
+    asyncio.run(run_all(args.pdf_path, args.question, args.top_k, args.n))
 
 
 if __name__ == "__main__":